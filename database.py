@@ -1,125 +1,236 @@
-from datetime import datetime
+import asyncio
+import time
+import weakref
+from collections import OrderedDict
 from loader import dp
 
 
-async def check_user_exists(user_id: int):
-    async with dp["db"].acquire() as conn:
-        async with conn.transaction():
-            result = await conn.fetchrow('SELECT user_id FROM users WHERE user_id=$1', user_id)
-            return result is not None
+SQL_UPSERT_USER = '''INSERT INTO users (user_id, username) VALUES ($1, $2)
+    ON CONFLICT (user_id) DO UPDATE SET username = EXCLUDED.username
+    RETURNING (xmax = 0) AS is_new'''
+
+SQL_CREATE_USERS_IMPORT = '''CREATE TEMP TABLE users_import (user_id BIGINT, username TEXT) 
+    ON COMMIT DROP'''
+
+SQL_MERGE_USERS_IMPORT = '''INSERT INTO users (user_id, username) 
+    SELECT DISTINCT ON (user_id) user_id, username FROM users_import 
+    ON CONFLICT (user_id) DO UPDATE SET username = EXCLUDED.username'''
+
+# Колонки videos, которые реально используют обработчики
+VIDEO_COLUMNS = 'video_id, source_url, title, author, duration, thumbnail_url'
+
+SQL_GET_VIDEO = f'SELECT {VIDEO_COLUMNS} FROM videos WHERE source_url = $1'
+
+PLATFORMS = ('youtube', 'instagram', 'tiktok', 'vk', 'rutube')
+
+# Платформа подставляется литералом: на каждую свой текст запроса и на один параметр меньше
+SQL_ADD_VIDEO = {
+    platform: f'''INSERT INTO videos (source_url, title, author, upload_date, duration, thumbnail_url, platform) 
+    VALUES (LEFT($1, 2048), $2, $3, NOW(), $4, LEFT($5, 2048), '{platform}'::text) 
+    ON CONFLICT (source_url) DO UPDATE 
+    SET title=EXCLUDED.title, author=EXCLUDED.author, duration=EXCLUDED.duration, 
+    thumbnail_url=EXCLUDED.thumbnail_url 
+    RETURNING {VIDEO_COLUMNS}'''
+    for platform in PLATFORMS
+}
+
+# Рассчитан на индекс files (video_id, quality, type)
+SQL_GET_FILE = '''SELECT file_id, telegram_file_id FROM files 
+    WHERE video_id = $1 AND quality = $2 AND type = $3'''
+
+SQL_ADD_FILE_AND_DOWNLOAD = '''WITH f AS (
+        INSERT INTO files (video_id, telegram_file_id, type, size, quality) 
+        VALUES ($1, $2, $3, $4, $5) RETURNING file_id, telegram_file_id, size
+    ), d AS (
+        INSERT INTO downloads (user_id, video_id, file_id) 
+        SELECT $6, $1, file_id FROM f ON CONFLICT DO NOTHING
+    )
+    SELECT file_id, telegram_file_id, size FROM f'''
+
+SQL_GET_VIDEO_BY_ID = f'SELECT {VIDEO_COLUMNS} FROM videos WHERE video_id = $1'
+
+SQL_GET_ADMIN_LIST = 'SELECT array_agg(user_id) FROM users WHERE is_admin = true'
+
+SQL_USERS_STATS = '''SELECT COUNT(*) AS total,
+    COUNT(*) FILTER (WHERE first_seen >= NOW() - INTERVAL '1 day') AS daily,
+    COUNT(*) FILTER (WHERE first_seen >= NOW() - INTERVAL '7 days') AS weekly,
+    COUNT(*) FILTER (WHERE first_seen >= NOW() - INTERVAL '30 days') AS monthly
+    FROM users'''
+
+SQL_GET_ALL_USERS = 'SELECT user_id::bigint FROM users'
+
+
+VIDEO_CACHE_SIZE = 10000
+VIDEO_CACHE_TTL = 300  # секунды
+FILE_CACHE_TTL = 60  # секунды
+ADMIN_CACHE_TTL = 600  # секунды, страховка на случай отсутствия триггера
+
+# Триггер на users выполняет NOTIFY admins_changed при изменении is_admin
+ADMINS_CHANNEL = 'admins_changed'
+
+_MISSING = object()
 
 
-async def add_user(user_id: int, username: str = None):
+class RecordCache:
+    """LRU-кэш записей БД с ограниченным временем жизни"""
+    def __init__(self, maxsize: int = VIDEO_CACHE_SIZE, ttl: float = VIDEO_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._locks = weakref.WeakValueDictionary()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return _MISSING
+        value, expires_at = item
+        if time.monotonic() >= expires_at:
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value) -> None:
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        self._data.pop(key, None)
+
+    async def get_or_fetch(self, key, fetch):
+        """Возвращает значение из кэша или загружает его, не допуская дублирующих запросов"""
+        value = self.get(key)
+        if value is not _MISSING:
+            return value
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+
+        async with lock:
+            value = self.get(key)
+            if value is _MISSING:
+                value = await fetch()
+                # Отсутствие строки не кэшируем: ее может записать не только этот процесс
+                if value is not None:
+                    self.set(key, value)
+            return value
+
+
+_videos_by_url = RecordCache()
+_videos_by_id = RecordCache()
+_files = RecordCache(ttl=FILE_CACHE_TTL)
+
+_admins = None
+_admins_expires_at = 0.0
+_admins_listener = None
+
+
+async def upsert_user(user_id: int, username: str = None) -> bool:
+    return await dp["db"].fetchval(SQL_UPSERT_USER, user_id, username)
+
+
+async def bulk_add_users(rows: list):
+    # rows: [(user_id, username), ...] - грузим через COPY во временную таблицу и сливаем одним запросом
     async with dp["db"].acquire() as conn:
         async with conn.transaction():
-            await conn.execute(
-                'INSERT INTO users (user_id, username) VALUES ($1, $2) ON CONFLICT (user_id) DO UPDATE SET username = $2',
-                user_id, username
-            )
+            await conn.execute(SQL_CREATE_USERS_IMPORT)
+            await conn.copy_records_to_table('users_import', records=rows, columns=['user_id', 'username'])
+            await conn.execute(SQL_MERGE_USERS_IMPORT)
+
+
+async def _fetch_video(url: str):
+    return await dp["db"].fetchrow(SQL_GET_VIDEO, url)
 
 
 async def get_video(url: str):
-    async with dp["db"].acquire() as conn:
-        async with conn.transaction():
-            return await conn.fetchrow('SELECT * FROM videos WHERE source_url = $1', url)
+    url = str(url)[:2048]
+    return await _videos_by_url.get_or_fetch(url, lambda: _fetch_video(url))
 
 
-async def add_video(url: str, title: str, author: str, duration: str, thumbnail: str):
-    async with dp["db"].acquire() as conn:
-        async with conn.transaction():
-            # Преобразуем thumbnail в строку и обрезаем при необходимости
-            thumbnail_str = str(thumbnail)[:2048] if thumbnail else None
-            # Обрезаем source_url если он слишком длинный
-            url = str(url)[:2048]
-            
-            return await conn.fetchval(
-                '''INSERT INTO videos (source_url, title, author, upload_date, duration, thumbnail_url, platform) 
-                VALUES ($1, $2, $3, $4, $5, $6, $7) 
-                ON CONFLICT (source_url) DO UPDATE 
-                SET title=$2, author=$3, duration=$5, thumbnail_url=$6 
-                RETURNING video_id''',
-                url, title, author, datetime.now(), duration, thumbnail_str, 'instagram'  # Изменил platform на 'instagram'
-            )
+async def add_video(url: str, title: str, author: str, duration: str, thumbnail: str,
+                    platform: str = 'instagram'):
+    # source_url и thumbnail_url обрезаются до 2048 символов на стороне БД
+    video = await dp["db"].fetchrow(
+        SQL_ADD_VIDEO[platform],
+        url, title, author, duration, thumbnail or None
+    )
+
+    # Запись изменилась - сразу кладем свежую версию в кэш
+    _videos_by_url.set(video['source_url'], video)
+    _videos_by_id.set(video['video_id'], video)
+    return video
+
+
+async def _fetch_file(video_id: int, quality: str, file_type: str):
+    return await dp["db"].fetchrow(SQL_GET_FILE, video_id, quality, file_type)
 
 
 async def get_file(video_id: int, quality: str, file_type: str):
-    async with dp["db"].acquire() as conn:
-        async with conn.transaction():
-            return await conn.fetchrow(
-                'SELECT * FROM files WHERE video_id = $1 AND quality = $2 AND type = $3',
-                video_id, quality, file_type
-            )
+    return await _files.get_or_fetch(
+        (video_id, quality, file_type),
+        lambda: _fetch_file(video_id, quality, file_type)
+    )
 
 
-async def add_file(video_id: int, telegram_file_id: str, file_type: str, size: int, quality: str):
-    async with dp["db"].acquire() as conn:
-        async with conn.transaction():
-            return await conn.fetchval(
-                '''INSERT INTO files (video_id, telegram_file_id, type, size, quality) 
-                VALUES ($1, $2, $3, $4, $5) RETURNING file_id''',
-                video_id, telegram_file_id, file_type, size, quality
-            )
+async def add_file_and_download(user_id: int, video_id: int, telegram_file_id: str,
+                                file_type: str, size: int, quality: str):
+    # Файл и запись о скачивании сохраняются одним запросом
+    file = await dp["db"].fetchrow(
+        SQL_ADD_FILE_AND_DOWNLOAD,
+        video_id, telegram_file_id, file_type, size, quality, user_id
+    )
+    _files.set((video_id, quality, file_type), file)
+    return file
 
 
-async def add_download(user_id: int, video_id: int, file_id: int):
-    async with dp["db"].acquire() as conn:
-        async with conn.transaction():
-            await conn.execute(
-                '''INSERT INTO downloads (user_id, video_id, file_id) 
-                VALUES ($1, $2, $3) ON CONFLICT DO NOTHING''',
-                user_id, video_id, file_id
-            )
+async def _fetch_video_by_id(video_id: int):
+    return await dp["db"].fetchrow(SQL_GET_VIDEO_BY_ID, video_id)
 
 
 async def get_video_by_id(video_id: int):
-    async with dp["db"].acquire() as conn:
-        async with conn.transaction():
-            return await conn.fetchrow('SELECT * FROM videos WHERE video_id = $1', video_id)
+    return await _videos_by_id.get_or_fetch(video_id, lambda: _fetch_video_by_id(video_id))
 
 
 async def get_admin_list():
-    async with dp["db"].acquire() as conn:
-        async with conn.transaction():
-            admins = await conn.fetch('SELECT user_id FROM users WHERE is_admin = true')
-            return [admin['user_id'] for admin in admins]
+    global _admins, _admins_expires_at
+    if _admins is None or time.monotonic() >= _admins_expires_at:
+        admins = await dp["db"].fetchval(SQL_GET_ADMIN_LIST)
+        # array_agg по пустой выборке возвращает NULL
+        _admins = frozenset(admins or ())
+        _admins_expires_at = time.monotonic() + ADMIN_CACHE_TTL
+    return _admins
 
-async def get_users_stats():
-    async with dp["db"].acquire() as conn:
-        async with conn.transaction():
-            # Общее количество пользователей
-            total_users = await conn.fetchval('SELECT COUNT(*) FROM users')
-            
-            # Новые пользователи за день
-            daily_users = await conn.fetchval('''
-                SELECT COUNT(*) FROM users 
-                WHERE first_seen >= NOW() - INTERVAL '1 day'
-            ''')
-            
-            # Новые пользователи за неделю
-            weekly_users = await conn.fetchval('''
-                SELECT COUNT(*) FROM users 
-                WHERE first_seen >= NOW() - INTERVAL '7 days'
-            ''')
-            
-            # Новые пользователи за месяц
-            monthly_users = await conn.fetchval('''
-                SELECT COUNT(*) FROM users 
-                WHERE first_seen >= NOW() - INTERVAL '30 days'
-            ''')
-            
-            return {
-                'total': total_users,
-                'daily': daily_users,
-                'weekly': weekly_users,
-                'monthly': monthly_users
-            }
-
-async def get_all_users():
-    async with dp["db"].acquire() as conn:
-        async with conn.transaction():
-            users = await conn.fetch('SELECT user_id FROM users')
-            return [user['user_id'] for user in users]
+
+def _invalidate_admins(connection, pid, channel, payload):
+    global _admins
+    _admins = None
 
 
+async def start_admins_listener():
+    # Отдельное соединение из пула держим под LISTEN на все время работы бота
+    global _admins_listener
+    _admins_listener = await dp["db"].acquire()
+    await _admins_listener.add_listener(ADMINS_CHANNEL, _invalidate_admins)
 
-    
+
+async def stop_admins_listener():
+    global _admins_listener
+    if _admins_listener is None:
+        return
+    await _admins_listener.remove_listener(ADMINS_CHANNEL, _invalidate_admins)
+    await dp["db"].release(_admins_listener)
+    _admins_listener = None
+
+async def get_users_stats():
+    # Все счетчики за один проход по таблице
+    return dict(await dp["db"].fetchrow(SQL_USERS_STATS))
+
+async def iter_all_users():
+    # Курсор требует транзакцию; строки подгружаются порциями, а не списком целиком
+    async with dp["db"].acquire() as conn:
+        async with conn.transaction():
+            async for user in conn.cursor(SQL_GET_ALL_USERS, prefetch=10000):
+                yield user[0]
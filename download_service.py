@@ -1,10 +1,123 @@
 from pathlib import Path
 import yt_dlp
+import aiohttp
 import asyncio
-from datetime import datetime, timedelta
-from typing import Dict, Optional, Any
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from cachetools import TTLCache
+import threading
+import time
+import socket
+from types import MappingProxyType
+from typing import Callable, Dict, Optional, Any
+from urllib.parse import urljoin, urlsplit
+from urllib3.connection import HTTPConnection
 import os
-from config import tik_tok_proxy, instagram_proxy
+import re
+from operator import attrgetter
+try:
+    # orjson быстрее разбирает ответы API, но не обязателен
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+from config import tik_tok_proxy, instagram_proxy, INSTAGRAM_USERNAME, INSTAGRAM_PASSWORD
+from session_manager import InstagramService
+
+
+logger = logging.getLogger(__name__)
+
+# Ссылка без эмодзи и прочего мусора вокруг нее
+URL_PATTERN = re.compile(r'https?://[^\s<>"\']+')
+
+RUTUBE_ID_PATTERN = re.compile(r'rutube\.ru/(?:video|shorts|play/embed)/([0-9a-f]{32})')
+M3U8_RESOLUTION_PATTERN = re.compile(r'RESOLUTION=(\d+)x(\d+)')
+M3U8_BANDWIDTH_PATTERN = re.compile(r'[:,]BANDWIDTH=(\d+)')
+
+# Стандартные качества YouTube
+QUALITY_MAPPING = MappingProxyType({
+    1080: 'url1080',
+    720: 'url720',
+    480: 'url480',
+    360: 'url360',
+    240: 'url240',
+    144: 'url144'
+})
+
+# Ближайшее стандартное качество для каждой высоты, считается один раз при импорте
+MAX_MAPPED_HEIGHT = 2160
+HEIGHT_TO_FORMAT_ID = tuple(
+    QUALITY_MAPPING[min(QUALITY_MAPPING, key=lambda quality: abs(quality - height))]
+    for height in range(MAX_MAPPED_HEIGHT)
+)
+
+
+@dataclass(slots=True, frozen=True)
+class Fmt:
+    """Формат видео, доступный для скачивания"""
+    url: str
+    format_id: str
+    ext: str
+    filesize: int
+    format: str
+    duration: int
+    width: int
+    height: int
+    vcodec: str = ''
+    acodec: str = ''
+
+
+# Хосты, к которым yt_dlp обращается при первом же извлечении
+WARM_UP_HOSTS = ('www.youtube.com', 'www.tiktok.com', 'vk.com', 'rutube.ru')
+
+# Извлечение упирается в сеть, а не в CPU, поэтому потоков больше, чем ядер
+EXTRACT_WORKERS = min(32, max(16, (os.cpu_count() or 1) * 4))
+
+# Скачивание с перекодированием ffmpeg идет долго, поэтому у него свой, меньший пул:
+# длинные загрузки не должны занимать потоки, нужные для извлечения информации
+DOWNLOAD_WORKERS = min(16, max(4, (os.cpu_count() or 1) * 2))
+
+# DNS-ответы для многочисленных запросов yt_dlp к одним и тем же хостам
+DNS_CACHE_TTL = 300  # секунды
+_dns_cache = TTLCache(maxsize=256, ttl=DNS_CACHE_TTL)
+_dns_lock = threading.Lock()
+_original_getaddrinfo = socket.getaddrinfo
+
+
+def _cached_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    """socket.getaddrinfo с кэшированием успешных ответов"""
+    key = (host, port, family, type, proto, flags)
+    with _dns_lock:
+        result = _dns_cache.get(key)
+    if result is None:
+        result = tuple(_original_getaddrinfo(host, port, family, type, proto, flags))
+        with _dns_lock:
+            _dns_cache[key] = result
+    return list(result)
+
+
+# TCP keep-alive для соединений urllib3 (requests у yt_dlp и instagrapi): простаивающие
+# соединения пула не обрываются NAT и не требуют нового TLS-рукопожатия
+KEEPALIVE_SOCKET_OPTIONS = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+if hasattr(socket, 'TCP_KEEPIDLE'):
+    KEEPALIVE_SOCKET_OPTIONS += [
+        (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 30),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+    ]
+
+
+def _enable_tcp_keepalive():
+    # Список меняется на месте: urllib3 использует именно его как значение по умолчанию
+    options = HTTPConnection.default_socket_options
+    for option in KEEPALIVE_SOCKET_OPTIONS:
+        if option not in options:
+            options.append(option)
+
+
+# Строковые длительности до часа, чтобы не форматировать одно и то же заново
+DURATION_STRINGS = tuple(str(seconds) for seconds in range(3600))
 
 
 class VideoDownloadError(Exception):
@@ -12,10 +125,51 @@ class VideoDownloadError(Exception):
     pass
 
 
+def _safe_int(value: Any, default: int = 0) -> int:
+    """Безопасное преобразование в int"""
+    if value is None:
+        return default
+    # Чаще всего yt_dlp уже отдает int
+    if type(value) is int:
+        return value
+    try:
+        return int(value)
+    except (ValueError, TypeError, OverflowError):
+        pass
+    # Строки вида '12.5' и прочие числовые значения
+    try:
+        return int(float(value))
+    except (ValueError, TypeError, OverflowError):
+        return default
+
+
+def _duration_str(duration: int) -> str:
+    return DURATION_STRINGS[duration] if 0 <= duration < len(DURATION_STRINGS) else str(duration)
+
+
+def _safe_get_filesize(format_dict: Dict) -> int:
+    """Безопасное получение размера файла"""
+    filesize = format_dict.get('filesize')
+    if filesize is None:
+        filesize = format_dict.get('filesize_approx')
+    return _safe_int(filesize, 0)
+
+
 class BaseDownloader:
     """Базовый класс для загрузчиков видео"""
-    def __init__(self):
-        self.base_opts = {
+    __slots__ = ('base_opts', 'ydl_opts', 'merged_opts', '_local', '_instances', '_executor')
+
+    # Классификация ошибок yt_dlp: одно регулярное выражение с именованными группами,
+    # порядок ключей в словаре сообщений задает приоритет
+    _ERROR_PATTERN: Optional[re.Pattern] = None
+    _ERROR_MESSAGES: Dict[str, str] = {}
+    _ERROR_DEFAULT = "Не удалось загрузить видео"
+
+    def __init__(self, executor: Optional[Executor] = None):
+        # Пул потоков для блокирующих вызовов yt_dlp (None - пул цикла по умолчанию)
+        self._executor = executor
+        # Общие параметры только для чтения: подклассы собирают из них свои копии
+        self.base_opts = MappingProxyType({
             'quiet': True,
             'no_warnings': True,
             'extract_flat': False,
@@ -23,52 +177,132 @@ class BaseDownloader:
             'retries': 5,
             'no_check_certificate': True,
             'nocheckcertificate': True,
-            'http_headers': {
+            # Нужна одна запись: ссылки вида watch?v=X&list=Y не разворачиваем в плейлист
+            'noplaylist': True,
+            'playlist_items': '1',
+            'http_headers': MappingProxyType({
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
                 'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
                 'Accept-Language': 'en-US,en;q=0.5',
                 'Connection': 'keep-alive'
-            }
-        }
-
-    def _safe_int(self, value: Any, default: int = 0) -> int:
-        """Безопасное преобразование в int"""
-        try:
-            if value is None:
-                return default
-            if isinstance(value, str):
-                return int(float(value))
-            if isinstance(value, (int, float)):
-                return int(value)
-            return default
-        except (ValueError, TypeError):
-            return default
-
-    def _safe_get_filesize(self, format_dict: Dict) -> int:
-        """Безопасное получение размера файла"""
-        try:
-            filesize = format_dict.get('filesize')
-            if filesize is None:
-                filesize = format_dict.get('filesize_approx')
-            return self._safe_int(filesize, 0)
-        except (ValueError, TypeError):
-            return 0
+            })
+        })
+        self.ydl_opts = {}
+        # Итоговые параметры YoutubeDL; подклассы пересобирают их после задания ydl_opts
+        self.merged_opts = self.base_opts
+        # Экземпляры YoutubeDL переиспользуются между запросами, по одному на поток пула;
+        # вместе с ними переиспользуются HTTP-соединения и cookies
+        self._local = threading.local()
+        self._instances = []
+
+    def _get_ydl(self) -> yt_dlp.YoutubeDL:
+        """Возвращает экземпляр YoutubeDL текущего потока"""
+        ydl = getattr(self._local, 'ydl', None)
+        if ydl is None:
+            # YoutubeDL дописывает в переданные параметры, поэтому отдаем ему копию
+            ydl = self._local.ydl = yt_dlp.YoutubeDL(dict(self.merged_opts))
+            self._instances.append(ydl)
+        return ydl
+
+    def close(self) -> None:
+        """Закрывает созданные экземпляры YoutubeDL"""
+        instances, self._instances = self._instances, []
+        for ydl in instances:
+            ydl.close()
+
+    def _extract_info(self, url: str) -> Optional[Dict]:
+        """Синхронное извлечение информации, выполняется в пуле потоков"""
+        info = self._get_ydl().extract_info(url, download=False)
+        # Если ссылка все же оказалась плейлистом, берем первую запись
+        if info and info.get('entries') is not None:
+            info = next((entry for entry in info['entries'] if entry), None)
+        return info
+
+    async def _run_blocking(self, func: Callable, *args):
+        """Выполняет блокирующий вызов в пуле потоков"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def _extract(self, url: str) -> Optional[Dict]:
+        """Асинхронное извлечение информации о видео"""
+        return await self._run_blocking(self._extract_info, url)
+
+    def _download_error(self, error: Exception) -> VideoDownloadError:
+        """Подбирает понятное пользователю сообщение по тексту ошибки yt_dlp"""
+        found = set()
+        if self._ERROR_PATTERN is not None:
+            found = {match.lastgroup for match in self._ERROR_PATTERN.finditer(str(error))}
+        message = next((text for key, text in self._ERROR_MESSAGES.items() if key in found), self._ERROR_DEFAULT)
+        return VideoDownloadError(message)
 
     def _normalize_duration(self, duration: Any) -> int:
         """Нормализация длительности видео"""
-        return self._safe_int(duration, 0)
+        return _safe_int(duration, 0)
+
+    @staticmethod
+    def _formats_by_height(raw_formats, duration: int) -> Dict[int, Fmt]:
+        """Первый формат с прямой ссылкой для каждой высоты; остальные клавиатуре не нужны"""
+        formats = {}
+        for f in raw_formats or ():
+            if not f or not f.get('url'):
+                continue
+
+            height = _safe_int(f.get('height', 0))
+            if height <= 0 or height in formats:
+                continue
+
+            formats[height] = Fmt(
+                url=f['url'],
+                format_id=f'url{height}',
+                ext=f.get('ext', 'mp4'),
+                filesize=_safe_get_filesize(f),
+                format=f'{height}p',
+                duration=duration,
+                width=_safe_int(f.get('width'), 0),
+                height=height
+            )
+        return formats
+
+    @staticmethod
+    def _build_result(info: Dict, formats: list, duration: int, source_url: str) -> Dict:
+        """Итоговая информация о видео в общем для всех платформ виде"""
+        return {
+            'title': info.get('title', 'Без названия'),
+            'duration': _duration_str(duration),
+            'thumbnail': info.get('thumbnail', ''),
+            'author': info.get('uploader', 'Unknown'),
+            'formats': formats,
+            'source_url': source_url
+        }
 
-    async def get_video_info(self, url: str, ydl: yt_dlp.YoutubeDL) -> Optional[Dict]:
+    async def get_video_info(self, url: str) -> Optional[Dict]:
         """Получение информации о видео"""
         raise NotImplementedError()
 
 
 class YouTubeDownloader(BaseDownloader):
     """Загрузчик для YouTube"""
-    def __init__(self):
-        super().__init__()
+    __slots__ = ()
+
+    _ERROR_PATTERN = re.compile(
+        r'(?P<copyright>copyright)|(?P<private>private)|(?P<unavailable>unavailable|not available)'
+        r'|(?P<signin>sign in)|(?P<extract>unable to extract)',
+        re.IGNORECASE
+    )
+    _ERROR_MESSAGES = {
+        'copyright': "Видео недоступно из-за нарушения авторских прав",
+        'private': "Это приватное видео",
+        'unavailable': "Видео недоступно или было удалено",
+        'signin': "Видео требует авторизации",
+        'extract': "Не удалось получить видео. Возможно, оно недоступно"
+    }
+    _ERROR_DEFAULT = "Не удалось загрузить видео с YouTube"
+
+    def __init__(self, executor: Optional[Executor] = None):
+        super().__init__(executor)
         self.ydl_opts = {
             **self.base_opts,
+            # Только экстракторы своей платформы, без перебора всего реестра yt_dlp
+            'allowed_extractors': ['youtube', 'youtube:.+'],
             'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
             'merge_output_format': 'mp4',
             'postprocessor_args': [
@@ -77,14 +311,17 @@ class YouTubeDownloader(BaseDownloader):
                 '-strict', 'experimental',
                 '-movflags', '+faststart'
             ],
-            'cookiefile': 'cookies.txt'
+            'cookiefile': 'cookies.txt',
+            # Для выбора качества хватает форматов из ответа плеера, манифесты не запрашиваем
+            'extractor_args': {'youtube': {'skip': ['hls', 'dash', 'translated_subs']}},
+            'youtube_include_dash_manifest': False,
+            'youtube_include_hls_manifest': False
         }
+        self.merged_opts = {**self.base_opts, **self.ydl_opts}
         
-    async def get_video_info(self, url: str, ydl: yt_dlp.YoutubeDL) -> Optional[Dict]:
+    async def get_video_info(self, url: str) -> Optional[Dict]:
         try:
-            info = await asyncio.get_event_loop().run_in_executor(
-                None, lambda: ydl.extract_info(url, download=False)
-            )
+            info = await self._extract(url)
             
             if not info:
                 raise VideoDownloadError("Не удалось получить информацию о видео")
@@ -92,91 +329,66 @@ class YouTubeDownloader(BaseDownloader):
             formats = []
             duration = self._normalize_duration(info.get('duration', 0))
 
-            # Собираем аудио форматы
-            audio_formats = [f for f in info.get('formats', [])
-                           if f.get('acodec', 'none') != 'none'
-                           and (f.get('vcodec', 'none') == 'none' or not f.get('vcodec'))]
-            best_audio = max(audio_formats, key=lambda f: self._safe_get_filesize(f)) if audio_formats else None
-
-            # Собираем видео форматы
+            # Один проход по форматам: размер лучшего аудио и лучшее видео для каждой высоты
+            audio_size = 0
             video_formats = {}
-            for f in info.get('formats', []):
-                if f.get('vcodec', 'none') == 'none':
+            video_sizes = {}
+            for f in info.get('formats') or ():
+                vcodec = f.get('vcodec', 'none')
+                size = _safe_get_filesize(f)
+
+                if f.get('acodec', 'none') != 'none' and (vcodec == 'none' or not vcodec):
+                    audio_size = max(audio_size, size)
+
+                if vcodec == 'none':
                     continue
 
-                height = self._safe_int(f.get('height', 0))
+                height = _safe_int(f.get('height', 0))
                 if height <= 0:
                     continue
 
-                current_size = self._safe_get_filesize(f)
-                if height not in video_formats or current_size > self._safe_get_filesize(video_formats[height]):
+                if height not in video_sizes or size > video_sizes[height]:
                     video_formats[height] = f
+                    video_sizes[height] = size
 
             # Стандартизируем качество
-            quality_mapping = {
-                1080: 'url1080',
-                720: 'url720',
-                480: 'url480',
-                360: 'url360',
-                240: 'url240',
-                144: 'url144'
-            }
-
             for height, video_fmt in video_formats.items():
-                closest_quality = min(quality_mapping.keys(), key=lambda x: abs(x - height))
-                format_id = quality_mapping[closest_quality]
+                format_id = HEIGHT_TO_FORMAT_ID[min(height, MAX_MAPPED_HEIGHT - 1)]
 
-                video_size = self._safe_get_filesize(video_fmt)
-                audio_size = self._safe_get_filesize(best_audio) if best_audio else 0
-                total_size = video_size + audio_size
+                total_size = video_sizes[height] + audio_size
 
-                formats.append({
-                    'url': video_fmt.get('url', ''),
-                    'format_id': format_id,
-                    'ext': video_fmt.get('ext', 'mp4'),
-                    'filesize': total_size,
-                    'format': f'{height}p',
-                    'duration': duration,
-                    'width': self._safe_int(video_fmt.get('width'), 0),
-                    'height': height,
-                    'vcodec': video_fmt.get('vcodec', ''),
-                    'acodec': video_fmt.get('acodec', '')
-                })
+                formats.append(Fmt(
+                    url=video_fmt.get('url', ''),
+                    format_id=format_id,
+                    ext=video_fmt.get('ext', 'mp4'),
+                    filesize=total_size,
+                    format=f'{height}p',
+                    duration=duration,
+                    width=_safe_int(video_fmt.get('width'), 0),
+                    height=height,
+                    vcodec=video_fmt.get('vcodec', ''),
+                    acodec=video_fmt.get('acodec', '')
+                ))
 
-            return {
-                'title': info.get('title', 'Без названия'),
-                'duration': str(duration),
-                'thumbnail': info.get('thumbnail', ''),
-                'author': info.get('uploader', 'Unknown'),
-                'formats': sorted(formats, key=lambda x: self._safe_int(x['height'], 0), reverse=True),
-                'source_url': url
-            }
+            return self._build_result(info, sorted(formats, key=attrgetter('height'), reverse=True), duration, url)
 
         except yt_dlp.utils.DownloadError as e:
-            error_msg = str(e).lower()
-            if "copyright" in error_msg:
-                raise VideoDownloadError("Видео недоступно из-за нарушения авторских прав")
-            elif "private" in error_msg:
-                raise VideoDownloadError("Это приватное видео")
-            elif "unavailable" in error_msg or "not available" in error_msg:
-                raise VideoDownloadError("Видео недоступно или было удалено")
-            elif "sign in" in error_msg:
-                raise VideoDownloadError("Видео требует авторизации")
-            elif "unable to extract" in error_msg:
-                raise VideoDownloadError("Не удалось получить видео. Возможно, оно недоступно")
-            else:
-                raise VideoDownloadError("Не удалось загрузить видео с YouTube")
+            raise self._download_error(e)
         except Exception as e:
-            print(f"Ошибка в YouTube загрузчике: {str(e)}")
+            logger.exception("Ошибка в YouTube загрузчике")
             raise VideoDownloadError(f"Неожиданная ошибка при загрузке с YouTube: {str(e)}")
 
 
 class InstagramDownloader(BaseDownloader):
-    def __init__(self):
-        super().__init__()
-        from config import INSTAGRAM_USERNAME, INSTAGRAM_PASSWORD, instagram_proxy
-        from session_manager import InstagramService
-        self.instagram_service = InstagramService(
+    __slots__ = ('instagram_service', '_download_executor')
+
+    def __init__(self, executor: Optional[Executor] = None,
+                 instagram_service: Optional[InstagramService] = None,
+                 download_executor: Optional[Executor] = None):
+        super().__init__(executor)
+        # Пул для скачивания через yt_dlp (None - пул цикла по умолчанию)
+        self._download_executor = download_executor
+        self.instagram_service = instagram_service or InstagramService(
             username=INSTAGRAM_USERNAME,
             password=INSTAGRAM_PASSWORD,
             proxy=instagram_proxy
@@ -186,21 +398,25 @@ class InstagramDownloader(BaseDownloader):
             'format': 'best',
             'cookiefile': 'instagram.txt',
             'proxy': instagram_proxy,
-            'http_headers': {
+            'http_headers': MappingProxyType({
                 **self.base_opts['http_headers'],
                 'Accept': '*/*',
                 'Accept-Language': 'en-US,en;q=0.9',
                 'Origin': 'https://www.instagram.com',
                 'Referer': 'https://www.instagram.com/'
-            }
+            })
         }
+        self.merged_opts = {**self.base_opts, **self.ydl_opts}
     
-    async def get_video_info(self, url: str, ydl: yt_dlp.YoutubeDL = None) -> Optional[Dict]:
+    async def get_video_info(self, url: str) -> Optional[Dict]:
         try:
             if 'instagram.com' in url and ('/stories/' in url or '/reel/' in url or '/reels/' in url or '/p/' in url):
                 try:
                     info = await self.instagram_service.get_media_info(url)
                     if info:
+                        info['formats'] = [
+                            Fmt(**{**f, 'url': str(f['url'])}) for f in info.get('formats') or ()
+                        ]
                         return info
                 except Exception as e:
                     raise VideoDownloadError(f"Ошибка при получении информации: {str(e)}")
@@ -215,7 +431,11 @@ class InstagramDownloader(BaseDownloader):
             if 'instagram.com' in url and ('/stories/' in url or '/reel/' in url or '/reels/' in url or '/p/' in url):
                 success = await self.instagram_service.download_media(url, output_path)
                 if success:
-                    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+                    try:
+                        file_size = os.stat(output_path).st_size
+                    except FileNotFoundError:
+                        file_size = 0
+                    if file_size == 0:
                         raise VideoDownloadError("Файл не был загружен корректно")
                     return
                 raise VideoDownloadError("Не удалось скачать видео")
@@ -235,8 +455,6 @@ class InstagramDownloader(BaseDownloader):
                     return False
 
                 media_url = str(first_format['url'])
-                
-                from config import instagram_proxy
 
                 ydl_opts = {
                     'format': 'bestaudio/best',
@@ -251,28 +469,52 @@ class InstagramDownloader(BaseDownloader):
                     }]
                 }
                 
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([media_url])
+                await asyncio.get_running_loop().run_in_executor(
+                    self._download_executor, self._download_with_ydl, ydl_opts, media_url
+                )
                     
-                if os.path.exists(f"{output_path}.mp3"):
+                try:
                     os.rename(f"{output_path}.mp3", output_path)
                     return True
+                except FileNotFoundError:
+                    pass
                     
             return False
                 
         except Exception as e:
             return False
+
+    @staticmethod
+    def _download_with_ydl(ydl_opts: Dict, media_url: str) -> None:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            ydl.download([media_url])
         
                     
 class TikTokDownloader(BaseDownloader):
     """Загрузчик для TikTok"""
-    def __init__(self):
-        super().__init__()
+    __slots__ = ()
+
+    _ERROR_PATTERN = re.compile(
+        r'(?P<notfound>not found|404)|(?P<private>private)|(?P<blocked>blocked)|(?P<extract>unable to extract)',
+        re.IGNORECASE
+    )
+    _ERROR_MESSAGES = {
+        'notfound': "Видео в TikTok не найдено или было удалено",
+        'private': "Это приватное видео TikTok",
+        'blocked': "Видео заблокировано в вашем регионе",
+        'extract': "Не удалось получить видео из TikTok. Возможно, видео недоступно"
+    }
+    _ERROR_DEFAULT = "Не удалось загрузить видео из TikTok"
+
+    def __init__(self, executor: Optional[Executor] = None):
+        super().__init__(executor)
         self.ydl_opts = {
             **self.base_opts,
+            # Только экстракторы своей платформы, без перебора всего реестра yt_dlp
+            'allowed_extractors': ['tiktok', 'tiktok:.+', r'vm\.tiktok'],
             'format': 'best',
             'proxy': tik_tok_proxy,
-            'http_headers': {
+            'http_headers': MappingProxyType({
                 **self.base_opts['http_headers'],
                 'Accept': '*/*',
                 'Accept-Language': 'en-US,en;q=0.9',
@@ -281,14 +523,13 @@ class TikTokDownloader(BaseDownloader):
                 'Sec-Fetch-Site': 'same-origin',
                 'Sec-Fetch-Mode': 'cors',
                 'Sec-Fetch-Dest': 'empty'
-            }
+            })
         }
+        self.merged_opts = {**self.base_opts, **self.ydl_opts}
 
-    async def get_video_info(self, url: str, ydl: yt_dlp.YoutubeDL) -> Optional[Dict]:
+    async def get_video_info(self, url: str) -> Optional[Dict]:
         try:
-            info = await asyncio.get_event_loop().run_in_executor(
-                None, lambda: ydl.extract_info(url, download=False)
-            )
+            info = await self._extract(url)
 
             if not info:
                 raise VideoDownloadError("Не удалось получить информацию о видео")
@@ -296,253 +537,385 @@ class TikTokDownloader(BaseDownloader):
             duration = self._normalize_duration(info.get('duration', 0))
             formats = []
 
-            video_formats = [f for f in info.get('formats', []) if f.get('vcodec') != 'none']
-            if video_formats:
-                best_video = max(video_formats, key=lambda f: self._safe_get_filesize(f))
-                formats.append({
-                    'url': best_video.get('url', ''),
-                    'format_id': 'url720',
-                    'ext': best_video.get('ext', 'mp4'),
-                    'filesize': self._safe_get_filesize(best_video),
-                    'format': 'HD',
-                    'duration': duration,
-                    'width': self._safe_int(best_video.get('width'), 0),
-                    'height': self._safe_int(best_video.get('height'), 720)
-                })
+            # Самый большой видеоформат; размер каждого формата считаем один раз
+            best_video = None
+            best_size = -1
+            for f in info.get('formats') or ():
+                if f.get('vcodec') == 'none':
+                    continue
+                size = _safe_get_filesize(f)
+                if size > best_size:
+                    best_video, best_size = f, size
+
+            if best_video is not None:
+                formats.append(Fmt(
+                    url=best_video.get('url', ''),
+                    format_id='url720',
+                    ext=best_video.get('ext', 'mp4'),
+                    filesize=best_size,
+                    format='HD',
+                    duration=duration,
+                    width=_safe_int(best_video.get('width'), 0),
+                    height=_safe_int(best_video.get('height'), 720)
+                ))
             else:
-                formats.append({
-                    'url': info.get('url', ''),
-                    'format_id': 'url720',
-                    'ext': info.get('ext', 'mp4'),
-                    'filesize': self._safe_get_filesize(info),
-                    'format': 'HD',
-                    'duration': duration,
-                    'width': self._safe_int(info.get('width'), 0),
-                    'height': self._safe_int(info.get('height'), 720)
-                })
-
-            return {
-                'title': info.get('title', 'Без названия'),
-                'duration': str(duration),
-                'thumbnail': info.get('thumbnail', ''),
-                'author': info.get('uploader', 'Unknown'),
-                'formats': formats,
-                'source_url': url
-            }
+                formats.append(Fmt(
+                    url=info.get('url', ''),
+                    format_id='url720',
+                    ext=info.get('ext', 'mp4'),
+                    filesize=_safe_get_filesize(info),
+                    format='HD',
+                    duration=duration,
+                    width=_safe_int(info.get('width'), 0),
+                    height=_safe_int(info.get('height'), 720)
+                ))
+
+            return self._build_result(info, formats, duration, url)
 
         except yt_dlp.utils.DownloadError as e:
-            error_msg = str(e).lower()
-            if "not found" in error_msg or "404" in error_msg:
-                raise VideoDownloadError("Видео в TikTok не найдено или было удалено")
-            elif "private" in error_msg:
-                raise VideoDownloadError("Это приватное видео TikTok")
-            elif "blocked" in error_msg:
-                raise VideoDownloadError("Видео заблокировано в вашем регионе")
-            elif "unable to extract" in error_msg:
-                raise VideoDownloadError("Не удалось получить видео из TikTok. Возможно, видео недоступно")
-            else:
-                raise VideoDownloadError("Не удалось загрузить видео из TikTok")
+            raise self._download_error(e)
         except Exception as e:
-            print(f"Ошибка в TikTok загрузчике: {str(e)}")
+            logger.exception("Ошибка в TikTok загрузчике")
             raise VideoDownloadError(f"Неожиданная ошибка при загрузке с TikTok: {str(e)}")
 
 
 class VKDownloader(BaseDownloader):
     """Загрузчик для VK"""
-    def __init__(self):
-        super().__init__()
+    __slots__ = ()
+
+    _ERROR_PATTERN = re.compile(
+        r'(?P<deleted>deleted)|(?P<private>private)|(?P<unavailable>not available|unable to extract)|(?P<notfound>404)',
+        re.IGNORECASE
+    )
+    _ERROR_MESSAGES = {
+        'deleted': "Это видео было удалено из VK",
+        'private': "Это приватное видео VK",
+        'unavailable': "Видео ВКонтакте недоступно",
+        'notfound': "Видео не найдено"
+    }
+    _ERROR_DEFAULT = "Не удалось загрузить видео из VK"
+
+    def __init__(self, executor: Optional[Executor] = None):
+        super().__init__(executor)
         self.ydl_opts = {
             **self.base_opts,
+            # Только экстракторы своей платформы, без перебора всего реестра yt_dlp
+            'allowed_extractors': ['vk', 'vk:.+'],
             'format': 'best'
         }
+        self.merged_opts = {**self.base_opts, **self.ydl_opts}
 
-    async def get_video_info(self, url: str, ydl: yt_dlp.YoutubeDL) -> Optional[Dict]:
+    async def get_video_info(self, url: str) -> Optional[Dict]:
         try:
-            info = await asyncio.get_event_loop().run_in_executor(
-                None, lambda: ydl.extract_info(url, download=False)
-            )
+            info = await self._extract(url)
 
             if not info:
                 raise VideoDownloadError("Не удалось получить информацию о видео")
 
             duration = self._normalize_duration(info.get('duration', 0))
-            formats = []
-
-            for f in info.get('formats', []):
-                if not f or not f.get('url'):
-                    continue
-
-                height = self._safe_int(f.get('height', 0))
-                if height > 0:
-                    formats.append({
-                        'url': f['url'],
-                        'format_id': f'url{height}',
-                        'ext': f.get('ext', 'mp4'),
-                        'filesize': self._safe_get_filesize(f),
-                        'format': f'{height}p',
-                        'duration': duration,
-                        'width': self._safe_int(f.get('width'), 0),
-                        'height': height
-                    })
-
-            return {
-                'title': info.get('title', 'Без названия'),
-                'duration': str(duration),
-                'thumbnail': info.get('thumbnail', ''),
-                'author': info.get('uploader', 'Unknown'),
-                'formats': sorted(formats, key=lambda x: self._safe_int(x['height'], 0), reverse=True),
-                'source_url': url
-            }
+            formats = self._formats_by_height(info.get('formats'), duration)
+            return self._build_result(
+                info, [formats[height] for height in sorted(formats, reverse=True)], duration, url
+            )
 
         except yt_dlp.utils.DownloadError as e:
-            error_msg = str(e).lower()
-            if "deleted" in error_msg:
-                raise VideoDownloadError("Это видео было удалено из VK")
-            elif "private" in error_msg:
-                raise VideoDownloadError("Это приватное видео VK")
-            elif "not available" in error_msg or "unable to extract" in error_msg:
-                raise VideoDownloadError("Видео ВКонтакте недоступно")
-            elif "404" in error_msg:
-                raise VideoDownloadError("Видео не найдено")
-            else:
-                raise VideoDownloadError("Не удалось загрузить видео из VK")
+            raise self._download_error(e)
         except Exception as e:
-            print(f"Ошибка в VK загрузчике: {str(e)}")
+            logger.exception("Ошибка в VK загрузчике")
             raise VideoDownloadError(f"Неожиданная ошибка при загрузке с VK: {str(e)}")
 
 
 class RutubeDownloader(BaseDownloader):
     """Загрузчик для Rutube"""
-    def __init__(self):
-        super().__init__()
+    __slots__ = ('_http',)
+
+    _ERROR_PATTERN = re.compile(
+        r'(?P<notfound>not found|404)|(?P<private>private)|(?P<unavailable>unavailable|unable to extract)',
+        re.IGNORECASE
+    )
+    _ERROR_MESSAGES = {
+        'notfound': "Видео на Rutube не найдено или было удалено",
+        'private': "Это приватное видео Rutube",
+        'unavailable': "Видео Rutube недоступно или требует авторизации"
+    }
+    _ERROR_DEFAULT = "Не удалось загрузить видео с Rutube"
+
+    def __init__(self, executor: Optional[Executor] = None,
+                 http: Optional[Callable[[], aiohttp.ClientSession]] = None):
+        super().__init__(executor)
+        # Фабрика общей HTTP-сессии для запросов к API Rutube в обход yt_dlp
+        self._http = http
         self.ydl_opts = {
             **self.base_opts,
+            # Только экстракторы своей платформы, без перебора всего реестра yt_dlp
+            'allowed_extractors': ['rutube', 'rutube:.+'],
             'format': 'best',
-            'http_headers': {
+            'http_headers': MappingProxyType({
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
                 'Accept': '*/*',
                 'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
                 'Origin': 'https://rutube.ru',
                 'Referer': 'https://rutube.ru/'
-            }
+            })
         }
+        self.merged_opts = {**self.base_opts, **self.ydl_opts}
 
-    async def get_video_info(self, url: str, ydl: yt_dlp.YoutubeDL) -> Optional[Dict]:
+    async def get_video_info(self, url: str) -> Optional[Dict]:
         try:
             # Очищаем URL от эмодзи и лишних символов
-            import re
-            url_pattern = r'https?://[^\s<>"\']+'
-            match = re.search(url_pattern, url)
+            match = URL_PATTERN.search(url)
             clean_url = match.group(0) if match else url
             
-            info = await asyncio.get_event_loop().run_in_executor(
-                None, lambda: ydl.extract_info(clean_url, download=False)
-            )
+            # Сначала пробуем API Rutube напрямую, yt_dlp - только если это не удалось
+            info = await self._fetch_api_info(clean_url)
+            if info is None:
+                info = await self._extract(clean_url)
 
             if not info:
                 raise VideoDownloadError("Не удалось получить информацию о видео")
 
             duration = self._normalize_duration(info.get('duration', 0))
-            formats = []
+            formats = self._formats_by_height(info.get('formats'), duration)
 
-            for f in info.get('formats', []):
-                if not f or not f.get('url'):
-                    continue
+            # Если не нашли форматы с указанной высотой, добавляем лучший доступный
+            if not formats and 'url' in info:
+                formats[720] = Fmt(
+                    url=info['url'],
+                    format_id='url720',
+                    ext=info.get('ext', 'mp4'),
+                    filesize=_safe_get_filesize(info),
+                    format='HD',
+                    duration=duration,
+                    width=_safe_int(info.get('width'), 0),
+                    height=720
+                )
+
+            return self._build_result(
+                info, [formats[height] for height in sorted(formats, reverse=True)], duration, clean_url
+            )
 
-                height = self._safe_int(f.get('height', 0))
-                if height <= 0:
-                    continue
+        except yt_dlp.utils.DownloadError as e:
+            raise self._download_error(e)
+        except Exception as e:
+            logger.exception("Ошибка в Rutube загрузчике")
+            raise VideoDownloadError(f"Неожиданная ошибка при загрузке с Rutube: {str(e)}")
 
-                formats.append({
-                    'url': f['url'],
-                    'format_id': f'url{height}',
-                    'ext': f.get('ext', 'mp4'),
-                    'filesize': self._safe_get_filesize(f),
-                    'format': f'{height}p',
-                    'duration': duration,
-                    'width': self._safe_int(f.get('width'), 0),
-                    'height': height
-                })
+    async def _fetch_api_info(self, url: str) -> Optional[Dict]:
+        """Получает информацию через API Rutube в формате, похожем на ответ yt_dlp"""
+        match = RUTUBE_ID_PATTERN.search(url)
+        if self._http is None or not match:
+            return None
 
-            # Если не нашли форматы с указанной высотой, добавляем лучший доступный
-            if not formats and 'url' in info:
-                formats.append({
-                    'url': info['url'],
-                    'format_id': 'url720',
-                    'ext': info.get('ext', 'mp4'),
-                    'filesize': self._safe_get_filesize(info),
-                    'format': 'HD',
-                    'duration': duration,
-                    'width': self._safe_int(info.get('width'), 0),
-                    'height': 720
-                })
+        video_id = match.group(1)
+        session = self._http()
+        headers = self.ydl_opts['http_headers']
+        try:
+            video, options = await asyncio.gather(
+                self._get_json(session, f'https://rutube.ru/api/video/{video_id}/?format=json', headers),
+                self._get_json(session, f'https://rutube.ru/api/play/options/{video_id}/?format=json', headers)
+            )
+            m3u8_url = options['video_balancer']['m3u8']
+            async with session.get(m3u8_url, headers=headers) as response:
+                response.raise_for_status()
+                playlist = await response.text()
+
+            duration = _safe_int(video.get('duration'), 0)
+            formats = self._parse_m3u8_variants(playlist, str(response.url), duration)
+            if not formats:
+                return None
 
             return {
-                'title': info.get('title', 'Без названия'),
-                'duration': str(duration),
-                'thumbnail': info.get('thumbnail', ''),
-                'author': info.get('uploader', 'Unknown'),
-                'formats': sorted(formats, key=lambda x: self._safe_int(x['height'], 0), reverse=True),
-                'source_url': clean_url
+                'title': video['title'],
+                'duration': duration,
+                'thumbnail': video.get('thumbnail_url', ''),
+                'uploader': (video.get('author') or {}).get('name', 'Unknown'),
+                'formats': formats
             }
+        except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, TypeError, ValueError):
+            # Ошибка сети или изменилась схема ответа - уходим в yt_dlp
+            return None
+
+    @staticmethod
+    async def _get_json(session: aiohttp.ClientSession, url: str, headers: Dict) -> Dict:
+        async with session.get(url, headers=headers) as response:
+            response.raise_for_status()
+            return await response.json(loads=json_loads, content_type=None)
+
+    @staticmethod
+    def _parse_m3u8_variants(playlist: str, base_url: str, duration: int) -> list:
+        """Разбирает варианты качества из мастер-плейлиста HLS"""
+        formats = []
+        stream_info = None
+        for line in playlist.splitlines():
+            line = line.strip()
+            if line.startswith('#EXT-X-STREAM-INF:'):
+                stream_info = line
+            elif stream_info and line and not line.startswith('#'):
+                resolution = M3U8_RESOLUTION_PATTERN.search(stream_info)
+                bandwidth = M3U8_BANDWIDTH_PATTERN.search(stream_info)
+                formats.append({
+                    'url': urljoin(base_url, line),
+                    'ext': 'mp4',
+                    'width': int(resolution.group(1)) if resolution else 0,
+                    'height': int(resolution.group(2)) if resolution else 0,
+                    'filesize_approx': int(bandwidth.group(1)) * duration // 8 if bandwidth else None
+                })
+                stream_info = None
+        return formats
 
-        except yt_dlp.utils.DownloadError as e:
-            error_msg = str(e).lower()
-            if "not found" in error_msg or "404" in error_msg:
-                raise VideoDownloadError("Видео на Rutube не найдено или было удалено")
-            elif "private" in error_msg:
-                raise VideoDownloadError("Это приватное видео Rutube")
-            elif "unavailable" in error_msg or "unable to extract" in error_msg:
-                raise VideoDownloadError("Видео Rutube недоступно или требует авторизации")
-            else:
-                raise VideoDownloadError("Не удалось загрузить видео с Rutube")
-        except Exception as e:
-            print(f"Ошибка в Rutube загрузчике: {str(e)}")
-            raise VideoDownloadError(f"Неожиданная ошибка при загрузке с Rutube: {str(e)}")
+
+@lru_cache(maxsize=2048)
+def _host_platform(host: str) -> Optional[str]:
+    """Платформа по имени хоста, поддомены вроде www. и m. отбрасываются"""
+    while host:
+        platform = Downloader._HOST_TO_PLATFORM.get(host)
+        if platform:
+            return platform
+        host = host.partition('.')[2]
+    return None
 
 
 class Downloader:
     """Основной класс загрузчика"""
+    _HOST_TO_PLATFORM = {
+        'youtube.com': 'youtube',
+        'youtu.be': 'youtube',
+        'instagram.com': 'instagram',
+        'tiktok.com': 'tiktok',
+        'vk.com': 'vk',
+        'rutube.ru': 'rutube'
+    }
+
     def __init__(self):
-        self._cache = {}
-        self._cache_ttl = timedelta(minutes=5)
+        self._cache_ttl = 300.0  # секунды
+        # После _cache_ttl запись считается устаревшей, но до _cache_swr еще отдается сразу,
+        # а обновляется в фоне
+        self._cache_swr = 600.0  # секунды
+        # Ограниченный кэш: (future, fresh_until); старые записи вытесняются автоматически
+        self._cache = TTLCache(maxsize=1024, ttl=self._cache_swr)
+        self._refreshing: Dict[str, asyncio.Task] = {}
         
+        # Общая HTTP-сессия создается при первом обращении, уже внутри цикла событий
+        self._http: Optional[aiohttp.ClientSession] = None
+
+        # Кэш DNS и keep-alive ставятся один раз на процесс
+        if socket.getaddrinfo is not _cached_getaddrinfo:
+            socket.getaddrinfo = _cached_getaddrinfo
+        _enable_tcp_keepalive()
+
+        # Отдельный пул под извлечение, чтобы не делить пул цикла по умолчанию
+        self._executor = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS, thread_name_prefix='ytdlp-extract')
+        self._download_executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix='ytdlp-download')
+
+        # Один клиент Instagram на весь процесс, медиа качается через общую HTTP-сессию
+        self.instagram_service = InstagramService(
+            username=INSTAGRAM_USERNAME,
+            password=INSTAGRAM_PASSWORD,
+            proxy=instagram_proxy,
+            http=self.get_http_session,
+            executor=self._executor
+        )
+
         # Инициализация загрузчиков для разных платформ
         self._downloaders = {
-            'youtube': YouTubeDownloader(),
-            'instagram': InstagramDownloader(),
-            'tiktok': TikTokDownloader(),
-            'vk': VKDownloader(),
-            'rutube': RutubeDownloader()
+            'youtube': YouTubeDownloader(self._executor),
+            'instagram': InstagramDownloader(self._executor, self.instagram_service, self._download_executor),
+            'tiktok': TikTokDownloader(self._executor),
+            'vk': VKDownloader(self._executor),
+            'rutube': RutubeDownloader(self._executor, self.get_http_session)
         }
 
+    def get_http_session(self) -> aiohttp.ClientSession:
+        """Возвращает общую HTTP-сессию с пулом соединений"""
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+        return self._http
+
+    async def run_download(self, func: Callable, *args):
+        """Выполняет блокирующее скачивание в пуле загрузок"""
+        return await asyncio.get_running_loop().run_in_executor(self._download_executor, func, *args)
+
+    async def warm_up(self):
+        """Создает экземпляры YoutubeDL и заполняет кэш DNS заранее, чтобы первый запрос не ждал"""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(self._executor, self._downloaders[platform]._get_ydl)
+            for platform in ('youtube', 'tiktok', 'vk', 'rutube')
+        ))
+        # Ошибки разрешения имен не критичны: хост будет разрешен при первом запросе
+        await asyncio.gather(*(
+            loop.getaddrinfo(host, 443, type=socket.SOCK_STREAM)
+            for host in WARM_UP_HOSTS
+        ), return_exceptions=True)
+
+    async def close(self):
+        """Освобождает сетевые ресурсы и пул потоков"""
+        if self._http is not None and not self._http.closed:
+            await self._http.close()
+        for task in self._refreshing.values():
+            task.cancel()
+        self._executor.shutdown(wait=False)
+        self._download_executor.shutdown(wait=False)
+        for downloader in self._downloaders.values():
+            downloader.close()
+
     def _get_platform(self, url: str) -> Optional[str]:
         """Определяет платформу по URL"""
-        if 'youtube.com' in url or 'youtu.be' in url:
-            return 'youtube'
-        elif 'instagram.com' in url:
-            return 'instagram'
-        elif 'tiktok.com' in url:
-            return 'tiktok'
-        elif 'vk.com' in url:
-            return 'vk'
-        elif 'rutube.ru' in url:
-            return 'rutube'
-        return None
+        return _host_platform(urlsplit(url if '//' in url else f'//{url}').hostname or '')
 
     async def get_video_info(self, url: str) -> Optional[Dict]:
         """Получает информацию о видео с учетом платформы"""
+        # Проверяем кэш: там либо готовый результат, либо уже идущее извлечение
+        entry = self._cache.get(url)
+        if entry is not None:
+            future, fresh_until = entry
+            if future.done() and time.monotonic() >= fresh_until and url not in self._refreshing:
+                self._refreshing[url] = asyncio.create_task(self._refresh(url))
+            return await asyncio.shield(future)
+
+        # Одновременные запросы того же URL дождутся этого future
+        future = asyncio.get_running_loop().create_future()
+        self._cache[url] = (future, time.monotonic() + self._cache_ttl)
         try:
-            now = datetime.now()
-            
-            # Проверяем кэш
-            if url in self._cache:
-                cache_data, cache_time = self._cache[url]
-                if now - cache_time < self._cache_ttl:
-                    return cache_data.copy()
-                else:
-                    del self._cache[url]
+            result = await self._fetch_video_info(url)
+        except BaseException as e:
+            # Ошибки не кэшируем, но передаем уже ожидающим
+            self._discard(url, future)
+            if isinstance(e, asyncio.CancelledError):
+                # Отменен только первый вызывающий: остальные ожидающие получают обычную ошибку,
+                # а не CancelledError, и могут ответить пользователю
+                future.set_exception(VideoDownloadError("Запрос был прерван, попробуйте еще раз"))
+            else:
+                future.set_exception(e)
+            future.exception()
+            raise
+
+        if result is None:
+            self._discard(url, future)
+        future.set_result(result)
+        return result
 
+    async def _refresh(self, url: str):
+        """Обновляет устаревшую запись в фоне, пока вызывающие получают старую"""
+        try:
+            result = await self._fetch_video_info(url)
+            if result is not None:
+                # Всегда берем свежий результат: подписанные ссылки форматов и превью со временем истекают
+                future = asyncio.get_running_loop().create_future()
+                future.set_result(result)
+                self._cache[url] = (future, time.monotonic() + self._cache_ttl)
+        except Exception as e:
+            # Старая запись остается до конца периода устаревания
+            logger.warning("Не удалось обновить информацию о видео %s: %s", url, e)
+        finally:
+            self._refreshing.pop(url, None)
+
+    async def _fetch_video_info(self, url: str) -> Optional[Dict]:
+        """Извлекает информацию о видео без использования кэша"""
+        try:
             # Определяем платформу
             platform = self._get_platform(url)
             if not platform:
@@ -551,34 +924,38 @@ class Downloader:
             # Получаем соответствующий загрузчик
             downloader = self._downloaders[platform]
             
-            # Устанавливаем специфичные для платформы опции
-            ydl_opts = {**downloader.base_opts, **downloader.ydl_opts}
-            
             # Получаем информацию о видео
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                result = await downloader.get_video_info(url, ydl)
-                
-                if result:
-                    # Сохраняем в кэш
-                    self._cache[url] = (result.copy(), now)
-                    return result.copy()
-                    
+            result = await downloader.get_video_info(url)
+            if not result:
                 return None
 
+            # Результат общий для всех вызывающих, поэтому отдаем его только для чтения
+            # и без копий; изменяемую копию при необходимости дает .copy()
+            result['formats'] = tuple(result.get('formats') or ())
+            return MappingProxyType(result)
+
         except VideoDownloadError:
             raise
         except Exception as e:
             raise VideoDownloadError(f"Неожиданная ошибка при получении информации о видео: {str(e)}")
 
+    def _discard(self, url: str, future: asyncio.Future):
+        """Удаляет запись из кэша, если она все еще принадлежит этому future"""
+        entry = self._cache.get(url)
+        if entry is not None and entry[0] is future:
+            del self._cache[url]
+
     def clear_cache(self):
         """Очищает весь кэш"""
         self._cache.clear()
 
     def remove_from_cache(self, url: str):
         """Удаляет конкретный URL из кэша"""
-        if url in self._cache:
-            del self._cache[url]
+        self._cache.pop(url, None)
+
 
+@lru_cache(maxsize=1)
+def get_downloader() -> Downloader:
+    """Единственный экземпляр загрузчика, создается при первом обращении"""
+    return Downloader()
 
-# Создаем единственный экземпляр загрузчика
-downloader = Downloader()
\ No newline at end of file
@@ -4,7 +4,7 @@ from aiogram.filters import Command, Filter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from keyboards import get_admin_keyboard, get_cancel_keyboard
-from database import get_admin_list, get_users_stats, get_all_users
+from database import get_admin_list, get_users_stats, iter_all_users
 import asyncio
 
 admin_router = Router()
@@ -74,11 +74,10 @@ async def process_broadcast_content(message: Message, state: FSMContext):
     await state.clear()  # Сразу очищаем состояние
     status_message = await message.answer("⏳ Начинаю рассылку...")
     
-    users = await get_all_users()
     success_count = 0
     error_count = 0
     
-    for user_id in users:
+    async for user_id in iter_all_users():
         try:
             if message.photo:
                 if message.caption:
@@ -1,28 +1,29 @@
+import logging
 import os
+import re
+import time
 from typing import Optional, Dict, Any, Tuple
 from pathlib import Path
 import asyncio
 import tempfile
-from datetime import datetime, timedelta
+from datetime import datetime
 from collections import defaultdict
 import yt_dlp
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, BufferedInputFile, FSInputFile
 from aiogram.filters import Command
 from aiogram.exceptions import TelegramAPIError
-from config import tik_tok_proxy, instagram_proxy
+from config import tik_tok_proxy
 from database import (
-    check_user_exists,
-    add_user,
+    upsert_user,
     get_video,
     add_video,
     get_file,
-    add_file,
-    add_download,
+    add_file_and_download,
     get_video_by_id
 )
 from keyboards import check_subscription, get_download_keyboard, get_subscribe_keyboard
-from download_service import downloader, VideoDownloadError
+from download_service import get_downloader, VideoDownloadError, URL_PATTERN
 
 
 SUPPORTED_PLATFORMS = {
@@ -35,9 +36,99 @@ SUPPORTED_PLATFORMS = {
     'rutube.ru': 'rutube'
 }
 
+# Все домены платформ одним выражением: один проход по тексту вместо проверки каждого
+PLATFORM_PATTERN = re.compile('|'.join(map(re.escape, SUPPORTED_PLATFORMS)), re.IGNORECASE)
+
 MAX_RETRY_ATTEMPTS = 3
 TEMP_FILE_PREFIX = "video_download_"
 
+# Параметры скачивания по платформам собираются один раз; на запрос добавляются только
+# формат и путь к файлу, поэтому общие словари никогда не изменяются
+QUIET_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'noprogress': True,
+    'progress_hooks': [],
+    'logger': None,
+    'no_check_certificate': True,
+    'nocheckcertificate': True,
+    'noplaylist': True,
+    'playlist_items': '1'
+}
+
+AUDIO_OPTS = {
+    **QUIET_OPTS,
+    'format': 'bestaudio/best',
+    'postprocessors': [{
+        'key': 'FFmpegExtractAudio',
+        'preferredcodec': 'mp3',
+        'preferredquality': '192',
+    }]
+}
+
+AUDIO_OPTS_TIKTOK = {
+    **AUDIO_OPTS,
+    'proxy': tik_tok_proxy,
+    'http_headers': {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+        'Accept': '*/*',
+        'Accept-Language': 'en-US,en;q=0.9'
+    },
+    'socket_timeout': 30,
+    'retries': 5
+}
+
+COMMON_DOWNLOAD_OPTS = {
+    **QUIET_OPTS,
+    'socket_timeout': 30,
+    'retries': 5
+}
+
+VIDEO_OPTS_TIKTOK = {
+    **COMMON_DOWNLOAD_OPTS,
+    'format': 'best',
+    'merge_output_format': 'mp4',
+    'proxy': tik_tok_proxy,
+    'http_headers': {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
+        'Accept': '*/*',
+        'Accept-Language': 'en-US,en;q=0.9',
+        'Connection': 'keep-alive',
+        'Origin': 'https://www.tiktok.com',
+        'Referer': 'https://www.tiktok.com/'
+    }
+}
+
+VIDEO_OPTS_YOUTUBE = {
+    **COMMON_DOWNLOAD_OPTS,
+    'merge_output_format': 'mp4',
+    'postprocessor_args': [
+        '-c:v', 'libx264',
+        '-c:a', 'aac',
+        '-strict', 'experimental',
+        '-movflags', '+faststart'
+    ],
+    'fragment_retries': 50,
+    'retries': 50,
+    'socket_timeout': 120,
+    'cookiefile': 'cookies.txt',
+    'http_chunk_size': 10485760
+}
+
+VIDEO_OPTS_RUTUBE = {
+    **COMMON_DOWNLOAD_OPTS,
+    'merge_output_format': 'mp4',
+    'http_headers': {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
+        'Accept': '*/*',
+        'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+        'Origin': 'https://rutube.ru',
+        'Referer': 'https://rutube.ru/'
+    }
+}
+
+logger = logging.getLogger(__name__)
+
 user_router = Router()
 
 
@@ -72,14 +163,15 @@ class AntiSpam:
         self.max_requests = 30  # максимум запросов в окне
         self.time_window = 60  # окно в секундах
         self.block_duration = 300  # длительность блокировки в секундах
-        self.blocked_users = {}  # user_id -> время окончания блокировки
+        self.blocked_users = {}  # user_id -> время окончания блокировки по time.monotonic()
 
     def is_blocked(self, user_id: int) -> Tuple[bool, Optional[int]]:
         """Проверка блокировки пользователя"""
         if user_id in self.blocked_users:
             block_end_time = self.blocked_users[user_id]
-            if datetime.now() < block_end_time:
-                remaining = int((block_end_time - datetime.now()).total_seconds())
+            now = time.monotonic()
+            if now < block_end_time:
+                remaining = int(block_end_time - now)
                 return True, remaining
             else:
                 del self.blocked_users[user_id]
@@ -87,17 +179,17 @@ class AntiSpam:
 
     def add_request(self, user_id: int) -> bool:
         """Добавление нового запроса и проверка лимитов"""
-        now = datetime.now()
+        now = time.monotonic()
         user_times = self.user_requests[user_id]
         
         # Очищаем старые запросы
-        user_times = [time for time in user_times 
-                     if now - time < timedelta(seconds=self.time_window)]
+        user_times = [timestamp for timestamp in user_times 
+                     if now - timestamp < self.time_window]
         self.user_requests[user_id] = user_times
 
         # Проверяем количество запросов
         if len(user_times) >= self.max_requests:
-            self.blocked_users[user_id] = now + timedelta(seconds=self.block_duration)
+            self.blocked_users[user_id] = now + self.block_duration
             return False
 
         user_times.append(now)
@@ -158,9 +250,7 @@ async def validate_and_prepare_url(message: Message) -> Optional[Tuple[str, str]
     url = ''.join(c for c in message.text if c.isprintable() and not c.isspace())
     
     # Проверяем есть ли в тексте URL
-    import re
-    url_pattern = r'https?://[^\s<>"\']+'
-    match = re.search(url_pattern, url)
+    match = URL_PATTERN.search(url)
     if not match:
         return None
         
@@ -177,10 +267,8 @@ async def validate_and_prepare_url(message: Message) -> Optional[Tuple[str, str]
 
 def get_platform(url: str) -> Optional[str]:
     """Определение платформы из URL"""
-    for domain, platform in SUPPORTED_PLATFORMS.items():
-        if domain in url.lower():
-            return platform
-    return None
+    match = PLATFORM_PATTERN.search(url)
+    return SUPPORTED_PLATFORMS[match.group(0).lower()] if match else None
 
 
 async def download_audio(url: str, output_path: str) -> bool:
@@ -188,69 +276,36 @@ async def download_audio(url: str, output_path: str) -> bool:
     try:
         # Если это Instagram, используем специальный обработчик
         if 'instagram.com' in url.lower():
-            from download_service import downloader
-            instagram_downloader = downloader._downloaders['instagram']
+            instagram_downloader = get_downloader()._downloaders['instagram']
             return await instagram_downloader.download_audio(url, output_path)
             
         is_tiktok = 'tiktok.com' in url.lower()
-        
-        proxy_settings = {
-            'proxy': tik_tok_proxy if is_tiktok else None,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': '*/*',
-                'Accept-Language': 'en-US,en;q=0.9'
-            }
-        }
-
-        # Общие настройки для отключения прогресса
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': output_path,
-            'quiet': True,
-            'no_warnings': True,
-            'noprogress': True,
-            'progress_hooks': [],
-            'logger': None,
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'no_check_certificate': True,
-            'nocheckcertificate': True
-        }
-
-        if is_tiktok:
-            ydl_opts.update(proxy_settings)
-            ydl_opts.update({
-                'socket_timeout': 30,
-                'retries': 5
-            })
+        audio_opts = AUDIO_OPTS_TIKTOK if is_tiktok else AUDIO_OPTS
+        ydl_opts = {**audio_opts, 'outtmpl': output_path}
         
         # Чистим URL от эмодзи и лишних символов
-        import re
-        url_pattern = r'https?://[^\s<>"\']+'
-        match = re.search(url_pattern, url)
+        match = URL_PATTERN.search(url)
         clean_url = match.group(0) if match else url
         
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([clean_url])
+            await get_downloader().run_download(ydl.download, [clean_url])
             
             # Проверяем наличие файла с суффиксом .mp3
             mp3_path = f"{output_path}.mp3"
-            if os.path.exists(mp3_path):
+            try:
                 os.rename(mp3_path, output_path)
                 return True
+            except FileNotFoundError:
+                pass
             
             # Проверяем оригинальный путь
-            if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                return True
-                
-            return False
+            try:
+                return os.stat(output_path).st_size > 0
+            except FileNotFoundError:
+                return False
             
     except Exception as e:
-        print(f"Audio download error: {str(e)}")  # Для отладки
+        logger.warning("Audio download error: %s", e)
         return False
      
        
@@ -368,106 +423,33 @@ async def send_large_video(message: Message, video_path: str, caption: str) -> O
     return None
 
 
-async def download_video(url: str, output_path: str, format_id: str, is_tiktok: bool = False,
-                        is_youtube: bool = False, is_instagram: bool = False, is_rutube: bool = False) -> None:
+async def download_video(url: str, output_path: str, format_id: str, platform: Optional[str] = None) -> None:
     """Загрузка видео с учетом особенностей платформы"""
     try:
-        if is_instagram:
-            from download_service import downloader
-            instagram_downloader = downloader._downloaders['instagram']
+        if platform == 'instagram':
+            instagram_downloader = get_downloader()._downloaders['instagram']
             await instagram_downloader.download_video(url, output_path, format_id)
             return
 
-        # Базовые настройки прокси и заголовков
-        proxy_settings = {
-            'proxy': instagram_proxy if is_instagram else tik_tok_proxy if is_tiktok else None,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
-                'Accept': '*/*',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Connection': 'keep-alive'
-            }
-        }
-
-        # Общие настройки для отключения прогресса
-        common_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'noprogress': True,
-            'progress_hooks': [],
-            'logger': None,
-            'no_check_certificate': True,
-            'nocheckcertificate': True,
-            'socket_timeout': 30,
-            'retries': 5
-        }
-
         # Чистим URL от эмодзи и лишних символов
-        import re
-        url_pattern = r'https?://[^\s<>"\']+'
-        match = re.search(url_pattern, url)
+        match = URL_PATTERN.search(url)
         clean_url = match.group(0) if match else url
 
-        if is_tiktok:
+        if platform == 'tiktok':
+            ydl_opts = {**VIDEO_OPTS_TIKTOK, 'outtmpl': output_path}
+        elif platform == 'youtube':
             ydl_opts = {
-                **common_opts,
-                'format': 'best',
-                'outtmpl': output_path,
-                'merge_output_format': 'mp4',
-                **proxy_settings,
-                'http_headers': {
-                    **proxy_settings['http_headers'],
-                    'Origin': 'https://www.tiktok.com',
-                    'Referer': 'https://www.tiktok.com/'
-                }
-            }
-        elif is_youtube:
-            ydl_opts = {
-                **common_opts,
+                **VIDEO_OPTS_YOUTUBE,
                 'format': f'bestvideo[height<={format_id}]+bestaudio/best[height<={format_id}]',
-                'outtmpl': output_path,
-                'merge_output_format': 'mp4',
-                'postprocessor_args': [
-                    '-c:v', 'libx264',
-                    '-c:a', 'aac',
-                    '-strict', 'experimental',
-                    '-movflags', '+faststart'
-                ],
-                'fragment_retries': 50,
-                'retries': 50,
-                'socket_timeout': 120,
-                'cookiefile': 'cookies.txt',
-                'http_chunk_size': 10485760
-            }
-        elif is_rutube:
-            # Специальные настройки для Rutube
-            rutube_headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
-                'Accept': '*/*',
-                'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
-                'Origin': 'https://rutube.ru',
-                'Referer': 'https://rutube.ru/'
-            }
-            
-            ydl_opts = {
-                **common_opts,
-                'format': f'best[height<={format_id}]/best',
-                'outtmpl': output_path,
-                'merge_output_format': 'mp4',
-                'http_headers': rutube_headers
-            }
-        else:
-            ydl_opts = {
-                **common_opts,
-                'format': f'best[height<={format_id}]',
                 'outtmpl': output_path
             }
+        elif platform == 'rutube':
+            ydl_opts = {**VIDEO_OPTS_RUTUBE, 'format': f'best[height<={format_id}]/best', 'outtmpl': output_path}
+        else:
+            ydl_opts = {**COMMON_DOWNLOAD_OPTS, 'format': f'best[height<={format_id}]', 'outtmpl': output_path}
 
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            await asyncio.get_event_loop().run_in_executor(
-                None, 
-                lambda: ydl.download([clean_url])
-            )
+            await get_downloader().run_download(ydl.download, [clean_url])
 
     except Exception as e:
         raise VideoDownloadError(f"Ошибка при загрузке видео: {str(e)}")
@@ -477,8 +459,7 @@ async def download_video(url: str, output_path: str, format_id: str, is_tiktok:
 async def cmd_start(message: Message) -> None:
     """Обработка команды /start"""
     try:
-        if not await check_user_exists(message.from_user.id):
-            await add_user(message.from_user.id, message.from_user.username)
+        await upsert_user(message.from_user.id, message.from_user.username)
         await message.answer(
             "👋 Привет! Отправь мне ссылку на видео из YouTube, Instagram, TikTok, VK или Rutube, "
             "и я помогу тебе его скачать."
@@ -488,10 +469,7 @@ async def cmd_start(message: Message) -> None:
 
 
 @user_router.message(
-    lambda message: message.text and any(
-        platform in message.text.lower() 
-        for platform in SUPPORTED_PLATFORMS.keys()
-    )
+    lambda message: bool(message.text and PLATFORM_PATTERN.search(message.text))
 )
 async def process_video_url(message: Message) -> None:
     """Обработка сообщения с URL видео"""
@@ -524,10 +502,11 @@ async def process_video_url(message: Message) -> None:
         
         processing_msg = await message.answer("⏳ Получаю информацию о видео...")
         
-        # Получение информации о видео
-        video_info = await get_video(url)
-        
-        info = await downloader.get_video_info(url)
+        # Запрос к БД и получение информации о видео независимы - выполняем параллельно
+        video_info, info = await asyncio.gather(
+            get_video(url),
+            get_downloader().get_video_info(url)
+        )
         
         if not info:
             if processing_msg:
@@ -546,15 +525,15 @@ async def process_video_url(message: Message) -> None:
             }
 
             if not video_info:
-                video_id = await add_video(
+                video_info = await add_video(
                     url=url,
                     title=video_data['title'],
                     author=video_data['author'],
                     duration=video_data['duration'],
-                    thumbnail=video_data['thumbnail']
+                    thumbnail=video_data['thumbnail'],
+                    platform=video_data['platform']
                 )
-            else:
-                video_id = video_info['video_id']
+            video_id = video_info['video_id']
 
             if processing_msg:
                 await safe_delete_message(processing_msg)
@@ -705,10 +684,7 @@ async def process_new_download(callback: CallbackQuery, video_data: Dict,
             file_name = f"video_{int(datetime.now().timestamp())}"
             temp_path = Path(temp_dir) / file_name
 
-            is_tiktok = 'tiktok.com' in video_data['source_url']
-            is_youtube = 'youtube.com' in video_data['source_url'] or 'youtu.be' in video_data['source_url']
-            is_instagram = 'instagram.com' in video_data['source_url']
-            is_rutube = 'rutube.ru' in video_data['source_url']
+            platform = get_platform(video_data['source_url'])
 
             if file_type == 'video':
                 temp_path = temp_path.with_suffix('.mp4')
@@ -716,10 +692,7 @@ async def process_new_download(callback: CallbackQuery, video_data: Dict,
                     video_data['source_url'],
                     str(temp_path),
                     format_id,
-                    is_tiktok,
-                    is_youtube,
-                    is_instagram,
-                    is_rutube
+                    platform
                 )
             else:
                 temp_path = temp_path.with_suffix('.mp3')
@@ -761,7 +734,8 @@ async def save_file_info(message: Message, video_id: int, file_type: str,
     file_id = message.video.file_id if file_type == 'video' else message.audio.file_id
     file_size = file_path.stat().st_size
     
-    new_file_id = await add_file(
+    await add_file_and_download(
+        user_id=user_id,
         video_id=video_id,
         telegram_file_id=file_id,
         file_type=file_type,
@@ -769,12 +743,6 @@ async def save_file_info(message: Message, video_id: int, file_type: str,
         quality=format_id
     )
 
-    await add_download(
-        user_id=user_id,
-        video_id=video_id,
-        file_id=new_file_id
-    )
-
 
 async def handle_download_error(callback: CallbackQuery, error_message: str, video_id: int) -> None:
     """Обработка ошибок при загрузке"""
@@ -784,12 +752,10 @@ async def handle_download_error(callback: CallbackQuery, error_message: str, vid
         if len(caption_lines) > 1:
             url_line = caption_lines[1].strip()
             # Очищаем URL от эмодзи и лишних символов
-            import re
-            url_pattern = r'https?://[^\s<>"\']+'
-            match = re.search(url_pattern, url_line)
+            match = URL_PATTERN.search(url_line)
             if match:
                 clean_url = match.group(0)
-                info = await downloader.get_video_info(clean_url)
+                info = await get_downloader().get_video_info(clean_url)
                 keyboard = await get_download_keyboard(video_id, info)
                 await callback.message.edit_caption(
                     caption=f"{callback.message.caption}\n\n❌ {error_message}",
@@ -798,7 +764,7 @@ async def handle_download_error(callback: CallbackQuery, error_message: str, vid
                 )
                 return
     except Exception as e:
-        print(f"Ошибка в handle_download_error: {str(e)}")
+        logger.exception("Ошибка в handle_download_error")
     
     # Fallback если что-то пошло не так
     await callback.message.edit_caption(
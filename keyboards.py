@@ -71,15 +71,15 @@ def format_size(size_bytes: int) -> str:
 async def get_download_keyboard(video_id: int, info: dict) -> InlineKeyboardMarkup:
     keyboard = []
     duration = float(info.get('duration', 0))
-    formats = info.get('formats', [])
+    formats = info.get('formats', ())
     source_url = str(info.get('source_url', ''))
     
     # Проверяем наличие аудио в кэше
     cached_audio = await get_file(video_id, 'audio', 'audio')
     
     # Получаем размер аудио из форматов
-    audio_format = next((f for f in formats if f.get('format_id') == 'worstaudio'), None)
-    audio_size = audio_format.get('filesize', 0) if audio_format else estimate_video_size(duration, 'audio')
+    audio_format = next((f for f in formats if f.format_id == 'worstaudio'), None)
+    audio_size = audio_format.filesize if audio_format else estimate_video_size(duration, 'audio')
     
     # Аудио кнопка
     if audio_size < MAX_FILE_SIZE:  # Меньше 50MB
@@ -105,9 +105,9 @@ async def get_download_keyboard(video_id: int, info: dict) -> InlineKeyboardMark
     
     if is_instagram:
         # Для Instagram показываем только одну кнопку с лучшим качеством
-        best_format = max(formats, key=lambda x: x.get('filesize', 0) if x.get('filesize', 0) > 0 else 0)
+        best_format = max(formats, key=lambda x: x.filesize if x.filesize > 0 else 0)
         if best_format:
-            size = best_format.get('filesize', 0)
+            size = best_format.filesize
             cached_video = await get_file(video_id, '720', 'video')
             
             if size < MAX_FILE_SIZE:  # Меньше 50MB
@@ -137,12 +137,12 @@ async def get_download_keyboard(video_id: int, info: dict) -> InlineKeyboardMark
         
         for resolution, quality in video_resolutions:
             matching_format = next(
-                (f for f in formats if f.get('format_id') == f'url{quality}'), 
+                (f for f in formats if f.format_id == f'url{quality}'), 
                 None
             )
             
             if matching_format:
-                size = matching_format.get('filesize', 0)
+                size = matching_format.filesize
                 if not size:
                     size = estimate_video_size(duration, quality)
                 
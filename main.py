@@ -3,6 +3,11 @@ import asyncpg
 from aiogram.types import BotCommand
 
 from config import DB_HOST, DB_USER, DB_PASS, DB_NAME, DB_PORT
+from database import (
+    start_admins_listener,
+    stop_admins_listener
+)
+from download_service import get_downloader
 from handlers.user import user_router
 from handlers.admin import admin_router
 from loader import bot, dp
@@ -19,12 +24,20 @@ async def on_startup() -> None:
         database=DB_NAME,
         host=DB_HOST,
         port=DB_PORT,
-        max_size=100
+        min_size=10,
+        max_size=50,
+        # За PgBouncer в режиме transaction pooling здесь должен быть 0
+        statement_cache_size=256,
+        max_inactive_connection_lifetime=300
     )
+    await start_admins_listener()
+    await get_downloader().warm_up()
 
 
 async def on_shutdown() -> None:
+    await get_downloader().close()
     if "db" in dp.workflow_data:
+        await stop_admins_listener()
         await dp["db"].close()
 
 
@@ -1,50 +1,130 @@
 import aiohttp
+import asyncio
+from concurrent.futures import Executor
 from instagrapi import Client
 from instagrapi.exceptions import LoginRequired, ClientError
 import json
 import os
-from typing import Optional, Dict
+from typing import Callable, Optional, Dict
 from pathlib import Path
 
 
+MEDIA_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': '*/*',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Origin': 'https://www.instagram.com',
+    'Referer': 'https://www.instagram.com/'
+}
+
+
 class InstagramService:
-    def __init__(self, username: str, password: str, proxy: str = None):
+    def __init__(self, username: str, password: str, proxy: str = None,
+                 http: Optional[Callable[[], aiohttp.ClientSession]] = None,
+                 executor: Optional[Executor] = None):
         self.username = username
         self.password = password
         self.proxy = proxy
         self.client = None
         self.session_file = "instagram_session.json"
+        # Фабрика общей HTTP-сессии; без нее сервис держит собственную
+        self._http = http
+        self._own_http = None
+        # Клиент instagrapi синхронный: его запросы выполняются в пуле потоков,
+        # чтобы не останавливать цикл событий (None - пул цикла по умолчанию)
+        self._executor = executor
+        self._client_lock = asyncio.Lock()
+        # Клиент хранит состояние последнего запроса (last_json, cookies сессии requests),
+        # поэтому обращения к нему выполняются строго по одному
+        self._client_calls = asyncio.Lock()
+
+    async def _run(self, func: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def _run_client(self, func: Callable, *args):
+        """Выполняет запрос клиента instagrapi в пуле потоков, не допуская параллельных"""
+        async with self._client_calls:
+            return await self._run(func, *args)
+
+    def _get_http(self) -> aiohttp.ClientSession:
+        if self._http is not None:
+            return self._http()
+        if self._own_http is None or self._own_http.closed:
+            self._own_http = aiohttp.ClientSession()
+        return self._own_http
+
+    async def _download_to_file(self, client: Client, media_url: str, output_path: Path) -> bool:
+        """Скачивает медиа по прямой ссылке, переиспользуя соединения общей сессии"""
+        async with self._client_calls:
+            cookies = client.get_settings()['cookies']
+        async with self._get_http().get(
+            str(media_url),
+            headers=MEDIA_HEADERS,
+            cookies=cookies,
+            proxy=self.proxy,
+            ssl=False,
+            timeout=aiohttp.ClientTimeout(total=300, connect=60)
+        ) as response:
+            if response.status == 200:
+                with open(output_path, 'wb') as f:
+                    async for chunk in response.content.iter_chunked(8192):
+                        f.write(chunk)
+                return True
+        return False
         
     async def ensure_client(self) -> Client:
         """Обеспечивает наличие авторизованного клиента"""
         if self.client is not None:
             return self.client
-            
-        self.client = Client()
+
+        # Вход выполняется один раз, даже если клиент нужен сразу нескольким запросам
+        async with self._client_lock:
+            if self.client is None:
+                self.client = await self._run(self._login)
+        return self.client
+
+    def _login(self) -> Client:
+        """Создает клиента из сохраненной сессии или авторизуется заново"""
+        client = Client()
         if self.proxy:
-            self.client.set_proxy(self.proxy)
+            client.set_proxy(self.proxy)
             
         if os.path.exists(self.session_file):
             try:
                 with open(self.session_file, 'r') as f:
                     session_data = json.load(f)
-                    self.client.set_settings(session_data)
+                    client.set_settings(session_data)
                     try:
-                        self.client.get_timeline_feed()
-                        return self.client
+                        client.get_timeline_feed()
+                        return client
                     except LoginRequired:
                         pass
             except Exception as e:
                 pass
         
         try:
-            self.client.login(self.username, self.password)
+            client.login(self.username, self.password)
             with open(self.session_file, 'w') as f:
-                json.dump(self.client.get_settings(), f)
-            return self.client
+                json.dump(client.get_settings(), f)
+            return client
         except Exception as e:
             raise
 
+    @staticmethod
+    def _get_stories(client: Client, url: str):
+        """Возвращает истории пользователя из URL и ID запрошенной истории"""
+        parts = [p for p in url.split('/') if p]
+        username = parts[parts.index('stories') + 1]
+        story_id = parts[-1] if parts[-1].isdigit() else None
+
+        user_id = client.user_id_from_username(username)
+        return client.user_stories(user_id), story_id
+
+    @staticmethod
+    def _get_post(client: Client, url: str):
+        """Возвращает информацию о посте или reels"""
+        return client.media_info(client.media_pk_from_url(url))
+
     def extract_media_info(self, media_info) -> Dict:
         """Извлекает информацию о медиа в стандартизированном формате"""
         # Получаем размеры из разных возможных источников
@@ -96,15 +176,8 @@ class InstagramService:
             # Определяем тип URL
             if 'stories' in url:
                 try:
-                    # Извлекаем username и story_id из URL
-                    parts = [p for p in url.split('/') if p]
-                    username = parts[parts.index('stories') + 1]
-                    story_id = parts[-1] if parts[-1].isdigit() else None
-                    
-                    # Получаем user_id
-                    user_id = client.user_id_from_username(username)
-                    # Получаем все истории пользователя
-                    stories = client.user_stories(user_id)
+                    # Получаем все истории пользователя и ID запрошенной
+                    stories, story_id = await self._run_client(self._get_stories, client, url)
                     
                     if not stories:
                         raise Exception("No active stories found")
@@ -124,8 +197,7 @@ class InstagramService:
             else:
                 # Обрабатываем reels и обычные посты
                 try:
-                    media_pk = client.media_pk_from_url(url)
-                    media_info = client.media_info(media_pk)
+                    media_info = await self._run_client(self._get_post, client, url)
                     if media_info.media_type == 2:  # Видео
                         result = self.extract_media_info(media_info)
                         return result
@@ -142,12 +214,7 @@ class InstagramService:
             
             if 'stories' in url:
                 try:
-                    parts = [p for p in url.split('/') if p]
-                    username = parts[parts.index('stories') + 1]
-                    story_id = parts[-1] if parts[-1].isdigit() else None
-                    
-                    user_id = client.user_id_from_username(username)
-                    stories = client.user_stories(user_id)
+                    stories, story_id = await self._run_client(self._get_stories, client, url)
                     
                     if not stories:
                         raise Exception("No active stories found")
@@ -167,66 +234,19 @@ class InstagramService:
                     if not media_url:
                         raise Exception("Failed to get media URL")
 
-                    timeout = aiohttp.ClientTimeout(total=300, connect=60)
-                    conn = aiohttp.TCPConnector(force_close=True, ssl=False)
-                    
-                    headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                        'Accept': '*/*',
-                        'Accept-Language': 'en-US,en;q=0.9',
-                        'Origin': 'https://www.instagram.com',
-                        'Referer': 'https://www.instagram.com/'
-                    }
-                    
-                    async with aiohttp.ClientSession(
-                        connector=conn,
-                        timeout=timeout,
-                        headers=headers,
-                        cookies=client.get_settings()['cookies']
-                    ) as session:
-                        async with session.get(str(media_url), proxy=self.proxy) as response:
-                            if response.status == 200:
-                                with open(output_path, 'wb') as f:
-                                    async for chunk in response.content.iter_chunked(8192):
-                                        f.write(chunk)
-                                return True
-                    return False
+                    return await self._download_to_file(client, media_url, output_path)
                         
                 except Exception as e:
                     raise Exception(f"Error downloading story: {str(e)}")
                         
             else:
                 try:
-                    media_pk = client.media_pk_from_url(url)
-                    media_info = client.media_info(media_pk)
+                    media_info = await self._run_client(self._get_post, client, url)
                     
                     if not hasattr(media_info, 'video_url') or not media_info.video_url:
                         raise Exception("Media doesn't contain video")
                     
-                    timeout = aiohttp.ClientTimeout(total=300, connect=60)
-                    conn = aiohttp.TCPConnector(force_close=True, ssl=False)
-                    
-                    headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                        'Accept': '*/*',
-                        'Accept-Language': 'en-US,en;q=0.9',
-                        'Origin': 'https://www.instagram.com',
-                        'Referer': 'https://www.instagram.com/'
-                    }
-                    
-                    async with aiohttp.ClientSession(
-                        connector=conn,
-                        timeout=timeout,
-                        headers=headers,
-                        cookies=client.get_settings()['cookies']
-                    ) as session:
-                        async with session.get(str(media_info.video_url), proxy=self.proxy) as response:
-                            if response.status == 200:
-                                with open(output_path, 'wb') as f:
-                                    async for chunk in response.content.iter_chunked(8192):
-                                        f.write(chunk)
-                                return True
-                    return False
+                    return await self._download_to_file(client, media_info.video_url, output_path)
                         
                 except Exception as e:
                     raise Exception(f"Error downloading post: {str(e)}")